@@ -1,27 +1,41 @@
-from fastapi import FastAPI, HTTPException, Depends, Header, status
+from fastapi import FastAPI, HTTPException, Depends, Header, Request, status
 from fastapi.security import HTTPBearer
 from pydantic import BaseModel, UUID4, conint, constr
-from typing import List, Optional, Dict, Union
-from uuid import uuid4
+from typing import Annotated, List, Literal, Optional, Dict, Union
+from uuid import UUID, uuid4
 from datetime import datetime
 from enum import Enum
-import databases
+from collections import defaultdict, deque
+import asyncio
+import hashlib
+import os
+import operator
+import re
+import secrets
+import msgspec
+from cachetools import TTLCache
+from sortedcontainers import SortedDict
 import sqlalchemy
-from sqlalchemy import and_, or_
+from sqlalchemy import and_, bindparam
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncConnection, create_async_engine
 
 # Database setup
-DATABASE_URL = "sqlite:///./market.db"
-database = databases.Database(DATABASE_URL)
+DATABASE_URL = os.environ.get("DATABASE_URL", "sqlite+aiosqlite:///./market.db")
+# Stored in the database's user_version; bump on any incompatible schema change
+SCHEMA_VERSION = 1
 metadata = sqlalchemy.MetaData()
 
 # Models
 users = sqlalchemy.Table(
     "users",
     metadata,
-    sqlalchemy.Column("id", sqlalchemy.String(36), primary_key=True),
+    sqlalchemy.Column("id", sqlalchemy.LargeBinary(16), primary_key=True),
     sqlalchemy.Column("name", sqlalchemy.String(50)),
     sqlalchemy.Column("role", sqlalchemy.String(10)),
-    sqlalchemy.Column("api_key", sqlalchemy.String(50)),
+    sqlalchemy.Column("api_key", sqlalchemy.LargeBinary(32)),
+    sqlalchemy.Column("api_key_hash", sqlalchemy.BigInteger),
 )
 
 instruments = sqlalchemy.Table(
@@ -34,7 +48,7 @@ instruments = sqlalchemy.Table(
 balances = sqlalchemy.Table(
     "balances",
     metadata,
-    sqlalchemy.Column("user_id", sqlalchemy.String(36)),
+    sqlalchemy.Column("user_id", sqlalchemy.LargeBinary(16), sqlalchemy.ForeignKey("users.id", ondelete="CASCADE")),
     sqlalchemy.Column("ticker", sqlalchemy.String(10)),
     sqlalchemy.Column("amount", sqlalchemy.Integer),
     sqlalchemy.PrimaryKeyConstraint("user_id", "ticker"),
@@ -43,37 +57,229 @@ balances = sqlalchemy.Table(
 orders = sqlalchemy.Table(
     "orders",
     metadata,
-    sqlalchemy.Column("id", sqlalchemy.String(36), primary_key=True),
+    sqlalchemy.Column("id", sqlalchemy.LargeBinary(16), primary_key=True),
     sqlalchemy.Column("status", sqlalchemy.String(20)),
-    sqlalchemy.Column("user_id", sqlalchemy.String(36)),
+    sqlalchemy.Column("user_id", sqlalchemy.LargeBinary(16), sqlalchemy.ForeignKey("users.id", ondelete="CASCADE")),
     sqlalchemy.Column("timestamp", sqlalchemy.DateTime),
     sqlalchemy.Column("direction", sqlalchemy.String(4)),
-    sqlalchemy.Column("ticker", sqlalchemy.String(10)),
+    sqlalchemy.Column("ticker", sqlalchemy.String(10), sqlalchemy.ForeignKey("instruments.ticker", ondelete="CASCADE")),
     sqlalchemy.Column("qty", sqlalchemy.Integer),
     sqlalchemy.Column("price", sqlalchemy.Integer, nullable=True),
     sqlalchemy.Column("filled", sqlalchemy.Integer, default=0),
+    # Denormalized qty - filled, kept in step with filled on every match
+    sqlalchemy.Column("remaining", sqlalchemy.Integer),
     sqlalchemy.Column("order_type", sqlalchemy.String(10)),
 )
 
 transactions = sqlalchemy.Table(
     "transactions",
     metadata,
-    sqlalchemy.Column("ticker", sqlalchemy.String(10)),
+    sqlalchemy.Column("ticker", sqlalchemy.String(10), sqlalchemy.ForeignKey("instruments.ticker", ondelete="CASCADE")),
     sqlalchemy.Column("amount", sqlalchemy.Integer),
     sqlalchemy.Column("price", sqlalchemy.Integer),
     sqlalchemy.Column("timestamp", sqlalchemy.DateTime),
-    sqlalchemy.Column("buyer_id", sqlalchemy.String(36)),
-    sqlalchemy.Column("seller_id", sqlalchemy.String(36)),
+    sqlalchemy.Column("buyer_id", sqlalchemy.LargeBinary(16)),
+    sqlalchemy.Column("seller_id", sqlalchemy.LargeBinary(16)),
+)
+
+# Orders that still rest on a book and can be filled or cancelled
+order_is_open = orders.c.status.in_(("NEW", "PARTIALLY_EXECUTED"))
+
+# Indexes for per-ticker, per-user and history lookups, which also serve
+# the cascading deletes. balances needs none: its (user_id, ticker) primary
+# key already serves user_id lookups. The order book itself lives in memory.
+indexes = [
+    "CREATE INDEX IF NOT EXISTS idx_orders_ticker ON orders(ticker)",
+    "CREATE INDEX IF NOT EXISTS idx_orders_user ON orders(user_id)",
+    "CREATE INDEX IF NOT EXISTS idx_users_apikey_hash ON users(api_key_hash)",
+    "CREATE INDEX IF NOT EXISTS idx_tx_ticker_ts ON transactions(ticker, timestamp DESC)",
+]
+
+# Queries, built once and executed with bound parameters
+user_by_key_query = users.select().where(
+    and_(
+        users.c.api_key_hash == bindparam("h"),
+        users.c.api_key == bindparam("k")
+    )
 )
+delete_user_query = users.delete().where(users.c.id == bindparam("u")).returning(users)
+
+instruments_query = instruments.select()
+instrument_query = instruments.select().where(instruments.c.ticker == bindparam("t"))
+instrument_tickers_query = sqlalchemy.select(instruments.c.ticker)
+delete_instrument_query = instruments.delete().where(
+    instruments.c.ticker == bindparam("t")
+).returning(instruments.c.ticker)
+
+transaction_history_query = transactions.select().where(
+    transactions.c.ticker == bindparam("t")
+).order_by(transactions.c.timestamp.desc()).limit(bindparam("n"))
+
+user_balances_query = balances.select().where(balances.c.user_id == bindparam("u"))
+# Single-statement balance change; returns no row when a debit would take an
+# existing balance below zero, and a negative amount when debiting a missing one
+balance_delta_query = sqlite_insert(balances).values(
+    user_id=bindparam("u"),
+    ticker=bindparam("t"),
+    amount=bindparam("a")
+)
+balance_delta_query = balance_delta_query.on_conflict_do_update(
+    index_elements=[balances.c.user_id, balances.c.ticker],
+    set_={"amount": balances.c.amount + balance_delta_query.excluded.amount},
+    where=balances.c.amount + balance_delta_query.excluded.amount >= 0
+).returning(balances.c.amount)
+
+open_orders_query = orders.select().where(
+    and_(
+        orders.c.price.isnot(None),
+        order_is_open
+    )
+).order_by(orders.c.timestamp)
+user_orders_query = orders.select().where(orders.c.user_id == bindparam("u"))
+user_order_query = orders.select().where(
+    and_(
+        orders.c.id == bindparam("o"),
+        orders.c.user_id == bindparam("u")
+    )
+)
+cancel_order_query = orders.update().where(
+    and_(
+        orders.c.id == bindparam("o"),
+        order_is_open
+    )
+).values(status="CANCELLED")
+
+def fill_orders_query(order_updates: List[dict]):
+    # One UPDATE for every resting order touched by a match, keyed on id
+    filled = {update["id"]: update["filled"] for update in order_updates}
+    remaining = {update["id"]: update["remaining"] for update in order_updates}
+    statuses = {update["id"]: update["status"] for update in order_updates}
+    return orders.update().where(orders.c.id.in_(list(filled))).values(
+        filled=sqlalchemy.case(filled, value=orders.c.id),
+        remaining=sqlalchemy.case(remaining, value=orders.c.id),
+        status=sqlalchemy.case(statuses, value=orders.c.id)
+    )
+
+# SQLite tuning, applied to every new connection. journal_mode is stored in
+# the database file itself; the other settings are per connection.
+sqlite_pragmas = [
+    "PRAGMA foreign_keys=ON",
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA cache_size=-65536",
+    "PRAGMA busy_timeout=5000",
+]
+
+engine = create_async_engine(
+    DATABASE_URL,
+    pool_size=20,
+    max_overflow=10,
+    pool_pre_ping=True
+)
+
+@sqlalchemy.event.listens_for(engine.sync_engine, "connect")
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for pragma in sqlite_pragmas:
+        cursor.execute(pragma)
+    cursor.close()
+
+# In-memory order books
+class Book:
+    """Resting limit orders of one ticker, best price first on both sides.
+
+    Each side maps price to a FIFO deque of order dicts; `orders` indexes
+    the same dicts by id and `totals` keeps the unfilled quantity of every
+    level. The database remains the durable record, so the book must only
+    be changed after the matching write has committed.
+    """
+    
+    def __init__(self):
+        self.bids = SortedDict(operator.neg)
+        self.asks = SortedDict()
+        self.orders = {}
+        self.totals = {"BUY": {}, "SELL": {}}
+    
+    def side(self, direction: str) -> SortedDict:
+        return self.bids if direction == "BUY" else self.asks
+    
+    def add(self, order: dict):
+        price = order["price"]
+        self.side(order["direction"]).setdefault(price, deque()).append(order)
+        totals = self.totals[order["direction"]]
+        totals[price] = totals.get(price, 0) + order["remaining"]
+        self.orders[order["id"]] = order
+    
+    def remove(self, order_id: bytes):
+        order = self.orders.pop(order_id, None)
+        if order is None:
+            return
+        price = order["price"]
+        side = self.side(order["direction"])
+        totals = self.totals[order["direction"]]
+        level = side[price]
+        level.remove(order)
+        if level:
+            totals[price] -= order["remaining"]
+        else:
+            del side[price]
+            del totals[price]
+    
+    def remove_user(self, user_id: bytes):
+        for order in [o for o in self.orders.values() if o["user_id"] == user_id]:
+            self.remove(order["id"])
+    
+    def levels(self, direction: str, limit: int) -> List[dict]:
+        totals = self.totals[direction]
+        return [
+            {"price": price, "qty": totals[price]}
+            for price in self.side(direction).islice(stop=limit)
+        ]
+    
+    def match(self, direction: str, qty: int) -> List[tuple]:
+        """Plan the fills of an incoming order without changing the book."""
+        fills = []
+        opposite = "SELL" if direction == "BUY" else "BUY"
+        totals = self.totals[opposite]
+        for price, level in self.side(opposite).items():
+            if qty <= 0:
+                break
+            # A level the order consumes entirely needs no per-order checks
+            if totals[price] <= qty:
+                fills.extend((order, order["remaining"]) for order in level)
+                qty -= totals[price]
+                continue
+            for order in level:
+                if qty <= 0:
+                    break
+                execution_qty = min(qty, order["remaining"])
+                fills.append((order, execution_qty))
+                qty -= execution_qty
+        return fills
+    
+    def fill(self, order: dict, qty: int):
+        order["filled"] += qty
+        order["remaining"] -= qty
+        self.totals[order["direction"]][order["price"]] -= qty
+        if order["remaining"] <= 0:
+            self.remove(order["id"])
 
-engine = sqlalchemy.create_engine(DATABASE_URL)
-metadata.create_all(engine)
+books = defaultdict(Book)
 
 app = FastAPI(title="Toy Exchange", version="0.1.0")
 
 # Security
 security = HTTPBearer()
 
+# Authenticated users by api_key; api keys never change once issued
+user_cache = TTLCache(maxsize=10_000, ttl=300)
+
+# Public read caches; entries are also dropped whenever the data changes
+orderbook_cache = TTLCache(maxsize=10_000, ttl=0.05)
+instruments_cache = TTLCache(maxsize=1, ttl=5)
+
 # Enums
 class Direction(str, Enum):
     BUY = "BUY"
@@ -117,16 +323,47 @@ class Transaction(BaseModel):
     price: int
     timestamp: datetime
 
-class LimitOrderBody(BaseModel):
+# Order bodies are decoded with msgspec; "type" selects the struct
+class LimitOrderBody(msgspec.Struct, tag="LIMIT", tag_field="type"):
     direction: Direction
     ticker: str
-    qty: conint(gt=0)
-    price: conint(gt=0)
+    qty: Annotated[int, msgspec.Meta(gt=0)]
+    price: Annotated[int, msgspec.Meta(gt=0)]
 
-class MarketOrderBody(BaseModel):
+class MarketOrderBody(msgspec.Struct, tag="MARKET", tag_field="type"):
     direction: Direction
     ticker: str
-    qty: conint(gt=0)
+    qty: Annotated[int, msgspec.Meta(gt=0)]
+
+order_body_decoder = msgspec.json.Decoder(Union[LimitOrderBody, MarketOrderBody])
+
+# FastAPI never sees these bodies, so their schema is published by hand
+(order_body_schema,), order_body_components = msgspec.json.schema_components(
+    [Union[LimitOrderBody, MarketOrderBody]],
+    ref_template="#/components/schemas/{name}"
+)
+default_openapi = app.openapi
+
+def openapi() -> dict:
+    if app.openapi_schema is None:
+        schemas = default_openapi().setdefault("components", {}).setdefault("schemas", {})
+        for name, schema in order_body_components.items():
+            schemas.setdefault(name, schema)
+    return app.openapi_schema
+
+app.openapi = openapi
+
+class OrderOut(BaseModel):
+    id: UUID4
+    status: OrderStatus
+    user_id: UUID4
+    timestamp: datetime
+    order_type: Literal["LIMIT", "MARKET"]
+    direction: Direction
+    ticker: str
+    qty: int
+    price: Optional[int] = None
+    filled: int
 
 class CreateOrderResponse(BaseModel):
     success: bool = True
@@ -140,6 +377,14 @@ class DepositWithdrawBody(BaseModel):
     ticker: str
     amount: conint(gt=0)
 
+# Dependency to get a pooled connection; each request runs in one transaction,
+# committed when the handler returns and rolled back if it raises. Declared
+# with scope="function" so the commit happens before the response is sent.
+async def get_conn():
+    async with engine.connect() as conn:
+        yield conn
+        await conn.commit()
+
 # Dependency to get current user
 async def get_current_user(authorization: str = Header(None)):
     if not authorization or not authorization.startswith("TOKEN "):
@@ -148,9 +393,22 @@ async def get_current_user(authorization: str = Header(None)):
             detail="Invalid authorization header"
         )
     
-    api_key = authorization[6:]
-    query = users.select().where(users.c.api_key == api_key)
-    user = await database.fetch_one(query)
+    try:
+        api_key = bytes.fromhex(authorization[6:])
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid API key"
+        )
+    
+    user = user_cache.get(api_key)
+    if user:
+        return user
+    
+    # Only a cache miss touches the pool, and only for this one lookup
+    query_params = {"h": hash_api_key(api_key), "k": api_key}
+    async with engine.connect() as conn:
+        user = (await conn.execute(user_by_key_query, query_params)).mappings().first()
     
     if not user:
         raise HTTPException(
@@ -158,6 +416,8 @@ async def get_current_user(authorization: str = Header(None)):
             detail="Invalid API key"
         )
     
+    user = dict(user)
+    user_cache[api_key] = user
     return user
 
 # Dependency to check admin role
@@ -172,259 +432,163 @@ async def get_admin_user(user: dict = Depends(get_current_user)):
 # Startup event
 @app.on_event("startup")
 async def startup():
-    await database.connect()
-    # Add some initial data if needed
-    # await database.execute(users.insert().values(id=str(uuid4()), name="Admin", role="ADMIN", api_key="admin-key"))
+    async with engine.begin() as conn:
+        # There are no migrations: refuse to run on a database from another
+        # schema version instead of failing later on a missing column
+        version = (await conn.execute(sqlalchemy.text("PRAGMA user_version"))).scalar()
+        tables = await conn.run_sync(lambda sync_conn: sqlalchemy.inspect(sync_conn).get_table_names())
+        if tables and version != SCHEMA_VERSION:
+            raise RuntimeError(
+                f"{DATABASE_URL} has schema version {version}, expected {SCHEMA_VERSION}; "
+                "delete the file (with its -wal/-shm files) to recreate the database"
+            )
+        
+        await conn.run_sync(metadata.create_all)
+        await conn.execute(sqlalchemy.text(f"PRAGMA user_version = {SCHEMA_VERSION}"))
+        for index in indexes:
+            await conn.execute(sqlalchemy.text(index))
+        
+        # Load resting limit orders into the in-memory books
+        for order in (await conn.execute(open_orders_query)).mappings():
+            books[order["ticker"]].add(dict(order))
+        
+        tickers = (await conn.execute(instrument_tickers_query)).scalars()
+        for ticker in tickers:
+            start_matcher(ticker)
 
 # Shutdown event
 @app.on_event("shutdown")
 async def shutdown():
-    await database.disconnect()
+    # Let in-flight book operations finish before the pool goes away
+    await asyncio.gather(*[stop_matcher(ticker) for ticker in list(matchers)])
+    await engine.dispose()
 
 # Public endpoints
 @app.post("/api/v1/public/register", response_model=User, tags=["public"])
-async def register(new_user: NewUser):
-    user_id = str(uuid4())
-    api_key = f"key-{str(uuid4())}"
-    
-    query = users.insert().values(
-        id=user_id,
-        name=new_user.name,
-        role="USER",
-        api_key=api_key
-    )
-    await database.execute(query)
-    
-    return {
-        "id": user_id,
+async def register(new_user: NewUser, conn: AsyncConnection = Depends(get_conn, scope="function")):
+    api_key = secrets.token_bytes(32)
+    user = {
+        "id": uuid4().bytes,
         "name": new_user.name,
         "role": "USER",
-        "api_key": api_key
+        "api_key": api_key,
+        "api_key_hash": hash_api_key(api_key)
     }
+    await conn.execute(users.insert(), user)
+    
+    return user_out(user)
 
 @app.get("/api/v1/public/instrument", response_model=List[Instrument], tags=["public"])
 async def list_instruments():
-    query = instruments.select()
-    return await database.fetch_all(query)
+    # Only a cache miss checks out a connection
+    instrument_list = instruments_cache.get("all")
+    if instrument_list is None:
+        async with engine.connect() as conn:
+            rows = (await conn.execute(instruments_query)).mappings().all()
+        instrument_list = [dict(row) for row in rows]
+        instruments_cache["all"] = instrument_list
+    return instrument_list
 
 @app.get("/api/v1/public/orderbook/{ticker}", response_model=L2OrderBook, tags=["public"])
 async def get_orderbook(ticker: str, limit: int = 10):
     if limit > 25:
         limit = 25
     
-    # Get bids (BUY orders)
-    bid_query = orders.select().where(
-        and_(
-            orders.c.ticker == ticker,
-            orders.c.direction == "BUY",
-            or_(
-                orders.c.status == "NEW",
-                orders.c.status == "PARTIALLY_EXECUTED"
-            )
-        )
-    ).order_by(orders.c.price.desc()).limit(limit)
-    bids = await database.fetch_all(bid_query)
-    
-    # Get asks (SELL orders)
-    ask_query = orders.select().where(
-        and_(
-            orders.c.ticker == ticker,
-            orders.c.direction == "SELL",
-            or_(
-                orders.c.status == "NEW",
-                orders.c.status == "PARTIALLY_EXECUTED"
-            )
-        )
-    ).order_by(orders.c.price.asc()).limit(limit)
-    asks = await database.fetch_all(ask_query)
-    
-    # Aggregate levels
-    bid_levels = {}
-    for bid in bids:
-        if bid["price"] in bid_levels:
-            bid_levels[bid["price"]] += bid["qty"] - bid["filled"]
-        else:
-            bid_levels[bid["price"]] = bid["qty"] - bid["filled"]
-    
-    ask_levels = {}
-    for ask in asks:
-        if ask["price"] in ask_levels:
-            ask_levels[ask["price"]] += ask["qty"] - ask["filled"]
-        else:
-            ask_levels[ask["price"]] = ask["qty"] - ask["filled"]
+    # Cache the full 25-level depth and cut it down per request
+    levels = orderbook_cache.get(ticker)
+    if levels is None:
+        book = books.get(ticker)
+        if book is None:
+            return {"bid_levels": [], "ask_levels": []}
+        levels = (book.levels("BUY", 25), book.levels("SELL", 25))
+        orderbook_cache[ticker] = levels
     
     return {
-        "bid_levels": [{"price": p, "qty": q} for p, q in bid_levels.items()],
-        "ask_levels": [{"price": p, "qty": q} for p, q in ask_levels.items()]
+        "bid_levels": levels[0][:limit],
+        "ask_levels": levels[1][:limit]
     }
 
 @app.get("/api/v1/public/transactions/{ticker}", response_model=List[Transaction], tags=["public"])
-async def get_transaction_history(ticker: str, limit: int = 10):
+async def get_transaction_history(
+    ticker: str,
+    limit: int = 10,
+    conn: AsyncConnection = Depends(get_conn, scope="function")
+):
     if limit > 100:
         limit = 100
     
-    query = transactions.select().where(
-        transactions.c.ticker == ticker
-    ).order_by(transactions.c.timestamp.desc()).limit(limit)
-    return await database.fetch_all(query)
+    query_params = {"t": ticker, "n": limit}
+    return (await conn.execute(transaction_history_query, query_params)).mappings().all()
 
 # Balance endpoints
 @app.get("/api/v1/balance", response_model=Dict[str, int], tags=["balance"])
-async def get_balances(user: dict = Depends(get_current_user)):
-    query = balances.select().where(balances.c.user_id == str(user["id"]))
-    balance_records = await database.fetch_all(query)
+async def get_balances(
+    user: dict = Depends(get_current_user),
+    conn: AsyncConnection = Depends(get_conn, scope="function")
+):
+    query_params = {"u": user["id"]}
+    balance_records = (await conn.execute(user_balances_query, query_params)).mappings().all()
     return {b["ticker"]: b["amount"] for b in balance_records}
 
 # Order endpoints
-@app.post("/api/v1/order", response_model=CreateOrderResponse, tags=["order"])
+@app.post(
+    "/api/v1/order",
+    response_model=CreateOrderResponse,
+    tags=["order"],
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {"application/json": {"schema": order_body_schema}}
+        }
+    }
+)
 async def create_order(
-    order_body: Union[LimitOrderBody, MarketOrderBody],
+    request: Request,
     user: dict = Depends(get_current_user)
 ):
-    order_id = str(uuid4())
+    try:
+        order_body = order_body_decoder.decode(await request.body())
+    except msgspec.DecodeError as exc:
+        raise HTTPException(status_code=422, detail=body_errors(exc))
+    
     order_type = "LIMIT" if isinstance(order_body, LimitOrderBody) else "MARKET"
+    order = {
+        "id": uuid4().bytes,
+        "status": "NEW",
+        "user_id": user["id"],
+        "timestamp": datetime.now(),
+        "direction": order_body.direction,
+        "ticker": order_body.ticker,
+        "qty": order_body.qty,
+        "price": order_body.price if order_type == "LIMIT" else None,
+        "filled": 0,
+        "remaining": order_body.qty,
+        "order_type": order_type
+    }
     
-    # For market orders, we need to execute immediately
+    # Matching runs on the ticker's own worker, one order at a time
     if order_type == "MARKET":
-        # Find matching orders
-        opposite_direction = "SELL" if order_body.direction == "BUY" else "BUY"
-        
-        query = orders.select().where(
-            and_(
-                orders.c.ticker == order_body.ticker,
-                orders.c.direction == opposite_direction,
-                or_(
-                    orders.c.status == "NEW",
-                    orders.c.status == "PARTIALLY_EXECUTED"
-                )
-            )
-        ).order_by(orders.c.price.asc() if order_body.direction == "BUY" else orders.c.price.desc())
-        
-        matching_orders = await database.fetch_all(query)
-        
-        remaining_qty = order_body.qty
-        executed = False
-        
-        for match in matching_orders:
-            if remaining_qty <= 0:
-                break
-                
-            match_qty_available = match["qty"] - match["filled"]
-            execution_qty = min(remaining_qty, match_qty_available)
-            execution_price = match["price"]
-            
-            # Record transaction
-            transaction_query = transactions.insert().values(
-                ticker=order_body.ticker,
-                amount=execution_qty,
-                price=execution_price,
-                timestamp=datetime.now(),
-                buyer_id=user["id"] if order_body.direction == "BUY" else match["user_id"],
-                seller_id=match["user_id"] if order_body.direction == "BUY" else user["id"]
-            )
-            await database.execute(transaction_query)
-            
-            # Update matched order
-            new_filled = match["filled"] + execution_qty
-            new_status = "EXECUTED" if new_filled >= match["qty"] else "PARTIALLY_EXECUTED"
-            
-            update_match_query = orders.update().where(
-                orders.c.id == match["id"]
-            ).values(
-                filled=new_filled,
-                status=new_status
-            )
-            await database.execute(update_match_query)
-            
-            # Update balances
-            # For BUY: user gets qty, loses qty*price
-            # For SELL: user loses qty, gets qty*price
-            ticker = order_body.ticker
-            base_currency = "MEMCOIN"  # Assuming MEMCOIN is the base currency
-            
-            if order_body.direction == "BUY":
-                # Update buyer balance (receive ticker, pay base currency)
-                await update_balance(user["id"], ticker, execution_qty)
-                await update_balance(user["id"], base_currency, -execution_qty * execution_price)
-                
-                # Update seller balance (receive base currency, pay ticker)
-                await update_balance(match["user_id"], base_currency, execution_qty * execution_price)
-                await update_balance(match["user_id"], ticker, -execution_qty)
-            else:
-                # Update seller balance (receive base currency, pay ticker)
-                await update_balance(user["id"], base_currency, execution_qty * execution_price)
-                await update_balance(user["id"], ticker, -execution_qty)
-                
-                # Update buyer balance (receive ticker, pay base currency)
-                await update_balance(match["user_id"], ticker, execution_qty)
-                await update_balance(match["user_id"], base_currency, -execution_qty * execution_price)
-            
-            remaining_qty -= execution_qty
-            executed = True
-        
-        if remaining_qty > 0 and executed:
-            # Partially filled
-            status = "PARTIALLY_EXECUTED"
-        elif remaining_qty > 0:
-            # No matches found
-            status = "NEW"
-        else:
-            # Fully executed
-            status = "EXECUTED"
-        
-        # For market orders, we don't store them if fully executed
-        if status == "EXECUTED":
-            return {"success": True, "order_id": order_id}
-        
-        # Store partially executed or unmatched market order
-        insert_query = orders.insert().values(
-            id=order_id,
-            status=status,
-            user_id=user["id"],
-            timestamp=datetime.now(),
-            direction=order_body.direction,
-            ticker=order_body.ticker,
-            qty=order_body.qty,
-            price=None,
-            filled=order_body.qty - remaining_qty,
-            order_type="MARKET"
-        )
-        await database.execute(insert_query)
-        
-        return {"success": True, "order_id": order_id}
-    
-    else:  # LIMIT order
-        # Just store the order
-        insert_query = orders.insert().values(
-            id=order_id,
-            status="NEW",
-            user_id=user["id"],
-            timestamp=datetime.now(),
-            direction=order_body.direction,
-            ticker=order_body.ticker,
-            qty=order_body.qty,
-            price=order_body.price,
-            filled=0,
-            order_type="LIMIT"
-        )
-        await database.execute(insert_query)
-        
-        return {"success": True, "order_id": order_id}
-
-@app.get("/api/v1/order", response_model=List[Union[LimitOrderBody, MarketOrderBody]], tags=["order"])
-async def list_orders(user: dict = Depends(get_current_user)):
-    query = orders.select().where(orders.c.user_id == user["id"])
-    return await database.fetch_all(query)
-
-@app.get("/api/v1/order/{order_id}", response_model=Union[LimitOrderBody, MarketOrderBody], tags=["order"])
-async def get_order(order_id: str, user: dict = Depends(get_current_user)):
-    query = orders.select().where(
-        and_(
-            orders.c.id == order_id,
-            orders.c.user_id == user["id"]
-        )
-    )
-    order = await database.fetch_one(query)
+        await submit(order_body.ticker, execute_market_order, order)
+    else:
+        await submit(order_body.ticker, add_limit_order, order)
+    
+    return {"success": True, "order_id": UUID(bytes=order["id"])}
+
+@app.get("/api/v1/order", response_model=List[OrderOut], tags=["order"])
+async def list_orders(
+    user: dict = Depends(get_current_user),
+    conn: AsyncConnection = Depends(get_conn, scope="function")
+):
+    return (await conn.execute(user_orders_query, {"u": user["id"]})).mappings().all()
+
+@app.get("/api/v1/order/{order_id}", response_model=OrderOut, tags=["order"])
+async def get_order(
+    order_id: UUID,
+    user: dict = Depends(get_current_user),
+    conn: AsyncConnection = Depends(get_conn, scope="function")
+):
+    query_params = {"o": order_id.bytes, "u": user["id"]}
+    order = (await conn.execute(user_order_query, query_params)).mappings().first()
     
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
@@ -432,15 +596,15 @@ async def get_order(order_id: str, user: dict = Depends(get_current_user)):
     return order
 
 @app.delete("/api/v1/order/{order_id}", response_model=Ok, tags=["order"])
-async def cancel_order(order_id: str, user: dict = Depends(get_current_user)):
-    # Check if order exists and belongs to user
-    query = orders.select().where(
-        and_(
-            orders.c.id == order_id,
-            orders.c.user_id == user["id"]
-        )
-    )
-    order = await database.fetch_one(query)
+async def cancel_order(
+    order_id: UUID,
+    user: dict = Depends(get_current_user)
+):
+    # Check if order exists and belongs to user. The connection is released
+    # before waiting on the matcher, which needs one of its own.
+    query_params = {"o": order_id.bytes, "u": user["id"]}
+    async with engine.connect() as conn:
+        order = (await conn.execute(user_order_query, query_params)).mappings().first()
     
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
@@ -448,121 +612,318 @@ async def cancel_order(order_id: str, user: dict = Depends(get_current_user)):
     if order["status"] in ("EXECUTED", "CANCELLED"):
         raise HTTPException(status_code=400, detail="Order cannot be cancelled")
     
-    # Update order status
-    update_query = orders.update().where(
-        orders.c.id == order_id
-    ).values(status="CANCELLED")
-    await database.execute(update_query)
+    await submit(order["ticker"], cancel_resting_order, order_id.bytes)
     
     return {"success": True}
 
 # Admin endpoints
 @app.delete("/api/v1/admin/user/{user_id}", response_model=User, tags=["admin", "user"])
-async def delete_user(user_id: str, admin: dict = Depends(get_admin_user)):
-    # Get user first
-    query = users.select().where(users.c.id == user_id)
-    user = await database.fetch_one(query)
-    
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-    
-    # Delete user
-    delete_query = users.delete().where(users.c.id == user_id)
-    await database.execute(delete_query)
+async def delete_user(
+    user_id: UUID,
+    admin: dict = Depends(get_admin_user)
+):
+    # Stop authenticating the user from cache before touching the books
+    for api_key in [key for key, cached in user_cache.items() if cached["id"] == user_id.bytes]:
+        user_cache.pop(api_key, None)
     
-    # Also delete their balances and orders
-    await database.execute(balances.delete().where(balances.c.user_id == user_id))
-    await database.execute(orders.delete().where(orders.c.user_id == user_id))
+    # Take the user's orders off every book and hold each matcher there until
+    # the delete has committed, so no match can fill an order being deleted
+    release = asyncio.Event()
+    held = []
+    try:
+        for ticker in list(matchers):
+            parked = asyncio.get_running_loop().create_future()
+            done = asyncio.ensure_future(
+                submit(ticker, remove_user_orders, user_id.bytes, parked, release)
+            )
+            held.append(done)
+            await asyncio.wait([parked, done], return_when=asyncio.FIRST_COMPLETED)
+        
+        # Delete user; their balances and orders go with it via ON DELETE CASCADE
+        async with engine.connect() as conn:
+            user = (await conn.execute(delete_user_query, {"u": user_id.bytes})).mappings().first()
+            
+            if not user:
+                raise HTTPException(status_code=404, detail="User not found")
+            
+            await conn.commit()
+    finally:
+        release.set()
+        await asyncio.gather(*held, return_exceptions=True)
     
-    return user
+    user_cache.pop(user["api_key"], None)
+    return user_out(user)
 
 @app.post("/api/v1/admin/instrument", response_model=Ok, tags=["admin"])
-async def add_instrument(instrument: Instrument, admin: dict = Depends(get_admin_user)):
+async def add_instrument(
+    instrument: Instrument,
+    admin: dict = Depends(get_admin_user),
+    conn: AsyncConnection = Depends(get_conn, scope="function")
+):
     # Check if instrument already exists
-    query = instruments.select().where(instruments.c.ticker == instrument.ticker)
-    existing = await database.fetch_one(query)
+    query_params = {"t": instrument.ticker}
+    existing = (await conn.execute(instrument_query, query_params)).first()
     
     if existing:
         raise HTTPException(status_code=400, detail="Instrument already exists")
     
     # Add new instrument
-    insert_query = instruments.insert().values(
-        name=instrument.name,
-        ticker=instrument.ticker
-    )
-    await database.execute(insert_query)
+    await conn.execute(instruments.insert(), instrument.model_dump())
+    
+    await conn.commit()
+    instruments_cache.clear()
+    start_matcher(instrument.ticker)
     
     return {"success": True}
 
 @app.delete("/api/v1/admin/instrument/{ticker}", response_model=Ok, tags=["admin"])
-async def delete_instrument(ticker: str, admin: dict = Depends(get_admin_user)):
-    # Check if instrument exists
-    query = instruments.select().where(instruments.c.ticker == ticker)
-    existing = await database.fetch_one(query)
-    
-    if not existing:
-        raise HTTPException(status_code=404, detail="Instrument not found")
-    
-    # Delete instrument
-    delete_query = instruments.delete().where(instruments.c.ticker == ticker)
-    await database.execute(delete_query)
-    
-    # Also delete related orders and transactions
-    await database.execute(orders.delete().where(orders.c.ticker == ticker))
-    await database.execute(transactions.delete().where(transactions.c.ticker == ticker))
+async def delete_instrument(
+    ticker: str,
+    admin: dict = Depends(get_admin_user)
+):
+    # Runs on the ticker's matcher so no book operation is in flight while
+    # the instrument is deleted
+    await submit(ticker, remove_instrument, ticker)
+    instruments_cache.clear()
     
     return {"success": True}
 
 @app.post("/api/v1/admin/balance/deposit", response_model=Ok, tags=["admin", "balance"])
-async def deposit(body: DepositWithdrawBody, admin: dict = Depends(get_admin_user)):
-    await update_balance(body.user_id, body.ticker, body.amount)
+async def deposit(
+    body: DepositWithdrawBody,
+    admin: dict = Depends(get_admin_user),
+    conn: AsyncConnection = Depends(get_conn, scope="function")
+):
+    await update_balance(conn, body.user_id.bytes, body.ticker, body.amount)
     return {"success": True}
 
 @app.post("/api/v1/admin/balance/withdraw", response_model=Ok, tags=["admin", "balance"])
-async def withdraw(body: DepositWithdrawBody, admin: dict = Depends(get_admin_user)):
-    await update_balance(body.user_id, body.ticker, -body.amount)
+async def withdraw(
+    body: DepositWithdrawBody,
+    admin: dict = Depends(get_admin_user),
+    conn: AsyncConnection = Depends(get_conn, scope="function")
+):
+    await update_balance(conn, body.user_id.bytes, body.ticker, -body.amount)
     return {"success": True}
 
 # Helper functions
-async def update_balance(user_id: str, ticker: str, amount: int):
-    # Check current balance
-    # print(user_id)
-    # print(ticker)
-    # for r in await database.fetch_all(f'SELECT * FROM balances WHERE user_id = "{user_id}"" AND ticker = "{ticker}"'):
-    #     print("-------------")
-    #     print(r["user_id"])
-    #     print(r["ticker"])
-    #     print(r["amount"])
-    #     print("-------------")
-
-    query = balances.select().where(
-        and_(
-            balances.c.user_id == str(user_id),
-            balances.c.ticker == ticker
-        )
-    )
+def hash_api_key(api_key: bytes) -> int:
+    # 64-bit signed so it fits SQLite's INTEGER; collisions are resolved by
+    # also comparing the full key
+    digest = hashlib.blake2b(api_key, digest_size=8).digest()
+    return int.from_bytes(digest, "little", signed=True)
+
+missing_field_error = re.compile(r"Object missing required field `(\w+)`")
+
+def body_errors(exc: msgspec.DecodeError) -> List[dict]:
+    # Same shape as FastAPI's own request validation errors. msgspec reports
+    # a single error, as "<message>" or "<message> - at `$.<path>`".
+    msg, _, path = str(exc).partition(" - at `$")
+    loc = ["body"] + [part for part in path.rstrip("`").split(".") if part]
+    if not isinstance(exc, msgspec.ValidationError):
+        return [{"type": "json_invalid", "loc": loc, "msg": msg}]
+    
+    missing = missing_field_error.fullmatch(msg)
+    if missing:
+        return [{"type": "missing", "loc": loc + [missing.group(1)], "msg": "Field required"}]
+    return [{"type": "value_error", "loc": loc, "msg": msg}]
+
+def user_out(user) -> dict:
+    # Ids and keys are stored as raw bytes; the API exposes them as strings
+    return {
+        "id": UUID(bytes=user["id"]),
+        "name": user["name"],
+        "role": user["role"],
+        "api_key": user["api_key"].hex()
+    }
+
+async def insert_order(conn: AsyncConnection, order: dict):
+    # The owner may have been deleted while the order waited for its matcher
+    try:
+        await conn.execute(orders.insert(), order)
+    except IntegrityError:
+        raise HTTPException(status_code=404, detail="User not found")
+
+async def update_balance(conn: AsyncConnection, user_id: bytes, ticker: str, amount: int):
+    # Single-statement upsert; must run inside a transaction so that a
+    # rejected debit rolls back everything written before it
+    query_params = {"u": user_id, "t": ticker, "a": amount}
+    try:
+        new_amount = (await conn.execute(balance_delta_query, query_params)).scalar()
+    except IntegrityError:
+        raise HTTPException(status_code=404, detail="User not found")
+    if new_amount is None or new_amount < 0:
+        raise HTTPException(status_code=400, detail="Insufficient funds")
+
+# Matching engine
+#
+# Every ticker has a worker task that owns its Book and runs the queued
+# book operations one at a time, so concurrent requests can never match
+# against the same resting order. Each operation writes through its own
+# connection and only changes the book after that write has committed.
+matchers = {}
+
+async def matcher_worker(ticker: str, queue: asyncio.Queue):
+    book = books[ticker]
+    while True:
+        item = await queue.get()
+        if item is None:
+            break
+        operation, args, future = item
+        try:
+            result = await operation(book, *args)
+        except Exception as exc:
+            if not future.done():
+                future.set_exception(exc)
+        else:
+            if not future.done():
+                future.set_result(result)
+        finally:
+            orderbook_cache.pop(ticker, None)
+
+def start_matcher(ticker: str):
+    if ticker not in matchers:
+        queue = asyncio.Queue()
+        task = asyncio.create_task(matcher_worker(ticker, queue))
+        matchers[ticker] = (queue, task)
+
+def stop_matcher(ticker: str) -> Optional[asyncio.Task]:
+    # The operation in progress is never interrupted: queued ones are turned
+    # away and the worker exits on the sentinel once the current one is done
+    matcher = matchers.pop(ticker, None)
+    books.pop(ticker, None)
+    orderbook_cache.pop(ticker, None)
+    if matcher is None:
+        return None
+    
+    queue, task = matcher
+    while not queue.empty():
+        future = queue.get_nowait()[2]
+        if not future.done():
+            future.set_exception(HTTPException(status_code=404, detail="Instrument not found"))
+    queue.put_nowait(None)
+    return task
+
+async def submit(ticker: str, operation, *args):
+    # Only listed instruments have a matcher
+    if ticker not in matchers:
+        raise HTTPException(status_code=404, detail="Instrument not found")
+    
+    future = asyncio.get_running_loop().create_future()
+    await matchers[ticker][0].put((operation, args, future))
+    return await future
+
+async def add_limit_order(book: Book, order: dict):
+    async with engine.connect() as conn:
+        await insert_order(conn, order)
+        await conn.commit()
+    book.add(order)
+
+async def execute_market_order(book: Book, order: dict):
+    fills = book.match(order["direction"], order["qty"])
+    
+    # All fills of one incoming order happen at the same instant
+    now = datetime.now()
+    order["timestamp"] = now
+    
+    remaining_qty = order["qty"]
+    executed = False
+    
+    # Collect all writes and flush them once the match is done
+    tx_rows = []
+    order_updates = []
+    balance_deltas = {}
+    ticker = order["ticker"]
+    base_currency = "MEMCOIN"  # Assuming MEMCOIN is the base currency
     
-    balance = await database.fetch_one(query)
-    print(balance)
-    if balance:
-        new_amount = balance["amount"] + amount
-        if new_amount < 0:
-            raise HTTPException(status_code=400, detail="Insufficient funds")
+    for match, execution_qty in fills:
+        execution_price = match["price"]
         
-        update_query = balances.update().where(
-            and_(
-                balances.c.user_id == str(user_id),
-                balances.c.ticker == ticker
-            )
-        ).values(amount=new_amount)
-        await database.execute(update_query)
+        buyer_id = order["user_id"] if order["direction"] == "BUY" else match["user_id"]
+        seller_id = match["user_id"] if order["direction"] == "BUY" else order["user_id"]
+        
+        tx_rows.append({
+            "ticker": ticker,
+            "amount": execution_qty,
+            "price": execution_price,
+            "timestamp": now,
+            "buyer_id": buyer_id,
+            "seller_id": seller_id,
+        })
+        
+        new_remaining = match["remaining"] - execution_qty
+        order_updates.append({
+            "id": match["id"],
+            "filled": match["filled"] + execution_qty,
+            "remaining": new_remaining,
+            "status": "PARTIALLY_EXECUTED" if new_remaining > 0 else "EXECUTED",
+        })
+        
+        # Buyer receives ticker and pays base currency, seller the opposite
+        for key, delta in (
+            ((buyer_id, ticker), execution_qty),
+            ((buyer_id, base_currency), -execution_qty * execution_price),
+            ((seller_id, base_currency), execution_qty * execution_price),
+            ((seller_id, ticker), -execution_qty),
+        ):
+            balance_deltas[key] = balance_deltas.get(key, 0) + delta
+        
+        remaining_qty -= execution_qty
+        executed = True
+    
+    if remaining_qty > 0 and executed:
+        # Partially filled
+        status = "PARTIALLY_EXECUTED"
+    elif remaining_qty > 0:
+        # No matches found
+        status = "NEW"
     else:
-        if amount < 0:
-            raise HTTPException(status_code=400, detail="Insufficient funds")
+        # Fully executed
+        status = "EXECUTED"
+    
+    async with engine.connect() as conn:
+        if tx_rows:
+            await conn.execute(transactions.insert(), tx_rows)
+            await conn.execute(fill_orders_query(order_updates))
         
-        insert_query = balances.insert().values(
-            user_id=str(user_id),
-            ticker=ticker,
-            amount=amount
-        )
-        await database.execute(insert_query)
+        # Deltas are netted per (user, ticker) so each balance is touched once
+        for (user_id, balance_ticker), delta in balance_deltas.items():
+            if delta:
+                await update_balance(conn, user_id, balance_ticker, delta)
+        
+        # For market orders, we don't store them if fully executed
+        if status != "EXECUTED":
+            # Store partially executed or unmatched market order
+            order["status"] = status
+            order["filled"] = order["qty"] - remaining_qty
+            order["remaining"] = remaining_qty
+            await insert_order(conn, order)
+        
+        await conn.commit()
+    
+    for match, execution_qty in fills:
+        book.fill(match, execution_qty)
+
+async def cancel_resting_order(book: Book, order_id: bytes):
+    async with engine.connect() as conn:
+        result = await conn.execute(cancel_order_query, {"o": order_id})
+        if not result.rowcount:
+            raise HTTPException(status_code=400, detail="Order cannot be cancelled")
+        await conn.commit()
+    book.remove(order_id)
+
+async def remove_instrument(book: Book, ticker: str):
+    # Delete instrument; its orders and transactions go with it via ON DELETE CASCADE
+    async with engine.connect() as conn:
+        existing = (await conn.execute(delete_instrument_query, {"t": ticker})).first()
+        if not existing:
+            raise HTTPException(status_code=404, detail="Instrument not found")
+        await conn.commit()
+    
+    # Operations queued behind the delete are turned away
+    stop_matcher(ticker)
+
+async def remove_user_orders(book: Book, user_id: bytes, parked: asyncio.Future, release: asyncio.Event):
+    book.remove_user(user_id)
+    parked.set_result(None)
+    await release.wait()
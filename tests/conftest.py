@@ -0,0 +1,84 @@
+import contextlib
+import os
+import sqlite3
+import sys
+import tempfile
+from pathlib import Path
+from uuid import UUID
+
+import httpx
+import pytest
+
+# The engine is created at import time, so the database is chosen up front
+DB_PATH = Path(tempfile.mkdtemp()) / "market.db"
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{DB_PATH}"
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import main
+
+
+def remove_db():
+    for suffix in ("", "-wal", "-shm"):
+        Path(f"{DB_PATH}{suffix}").unlink(missing_ok=True)
+
+
+@pytest.fixture(autouse=True)
+def fresh_db():
+    remove_db()
+    main.user_cache.clear()
+    main.instruments_cache.clear()
+    main.orderbook_cache.clear()
+    main.books.clear()
+    yield
+    remove_db()
+
+
+def query(sql: str, *params):
+    with contextlib.closing(sqlite3.connect(DB_PATH)) as db:
+        return db.execute(sql, params).fetchall()
+
+
+@contextlib.asynccontextmanager
+async def running_app():
+    await main.startup()
+    try:
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            yield client
+    finally:
+        await main.shutdown()
+
+
+async def register(client, name: str) -> dict:
+    user = (await client.post("/api/v1/public/register", json={"name": name})).json()
+    user["headers"] = {"Authorization": "TOKEN " + user["api_key"]}
+    return user
+
+
+async def register_admin(client) -> dict:
+    admin = await register(client, "admin")
+    with contextlib.closing(sqlite3.connect(DB_PATH)) as db:
+        db.execute("UPDATE users SET role = 'ADMIN' WHERE id = ?", (UUID(admin["id"]).bytes,))
+        db.commit()
+    main.user_cache.clear()
+    return admin
+
+
+async def deposit(client, admin: dict, user: dict, ticker: str, amount: int):
+    body = {"user_id": user["id"], "ticker": ticker, "amount": amount}
+    response = await client.post("/api/v1/admin/balance/deposit", headers=admin["headers"], json=body)
+    assert response.status_code == 200
+
+
+async def list_instrument(client, admin: dict, ticker: str = "FOO"):
+    body = {"name": ticker.title(), "ticker": ticker}
+    response = await client.post("/api/v1/admin/instrument", headers=admin["headers"], json=body)
+    assert response.status_code == 200
+
+
+async def place(client, user: dict, **body):
+    return await client.post("/api/v1/order", headers=user["headers"], json=body)
+
+
+async def balance(client, user: dict) -> dict:
+    return (await client.get("/api/v1/balance", headers=user["headers"])).json()
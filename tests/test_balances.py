@@ -0,0 +1,115 @@
+import asyncio
+from uuid import UUID, uuid4
+
+import main
+from conftest import (
+    balance,
+    deposit,
+    list_instrument,
+    place,
+    query,
+    register,
+    register_admin,
+    running_app,
+)
+
+
+async def move_balance(client, admin: dict, action: str, user_id: str, ticker: str, amount: int):
+    body = {"user_id": user_id, "ticker": ticker, "amount": amount}
+    return await client.post(f"/api/v1/admin/balance/{action}", headers=admin["headers"], json=body)
+
+
+def balance_rows(user: dict):
+    return query("SELECT ticker, amount FROM balances WHERE user_id = ?", UUID(user["id"]).bytes)
+
+
+def test_deposit_and_withdraw_update_one_row():
+    async def scenario():
+        async with running_app() as client:
+            admin = await register_admin(client)
+            user = await register(client, "user")
+            statuses = [
+                (await move_balance(client, admin, "deposit", user["id"], "FOO", 5)).status_code,
+                (await move_balance(client, admin, "deposit", user["id"], "FOO", 7)).status_code,
+                (await move_balance(client, admin, "withdraw", user["id"], "FOO", 12)).status_code,
+            ]
+            return statuses, user, await balance(client, user)
+
+    statuses, user, user_balance = asyncio.run(scenario())
+    assert statuses == [200, 200, 200]
+    assert user_balance == {"FOO": 0}
+    assert balance_rows(user) == [("FOO", 0)]
+
+
+def test_overdrawing_an_existing_balance_is_rejected():
+    async def scenario():
+        async with running_app() as client:
+            admin = await register_admin(client)
+            user = await register(client, "user")
+            await deposit(client, admin, user, "FOO", 5)
+            response = await move_balance(client, admin, "withdraw", user["id"], "FOO", 6)
+            return response, user
+
+    response, user = asyncio.run(scenario())
+    assert response.status_code == 400
+    assert response.json() == {"detail": "Insufficient funds"}
+    assert balance_rows(user) == [("FOO", 5)]
+
+
+def test_withdrawing_from_a_missing_balance_leaves_no_row():
+    async def scenario():
+        async with running_app() as client:
+            admin = await register_admin(client)
+            user = await register(client, "user")
+            response = await move_balance(client, admin, "withdraw", user["id"], "FOO", 3)
+            return response, user
+
+    response, user = asyncio.run(scenario())
+    # The upsert inserts the negative amount; the request must roll it back
+    assert response.status_code == 400
+    assert response.json() == {"detail": "Insufficient funds"}
+    assert balance_rows(user) == []
+
+
+def test_deposit_for_an_unknown_user_is_not_found():
+    async def scenario():
+        async with running_app() as client:
+            admin = await register_admin(client)
+            return await move_balance(client, admin, "deposit", str(uuid4()), "FOO", 3)
+
+    response = asyncio.run(scenario())
+    assert response.status_code == 404
+    assert response.json() == {"detail": "User not found"}
+    assert query("SELECT COUNT(*) FROM balances") == [(0,)]
+
+
+def test_market_order_without_funds_leaves_book_and_database_untouched():
+    async def scenario():
+        async with running_app() as client:
+            admin = await register_admin(client)
+            await list_instrument(client, admin)
+            maker = await register(client, "maker")
+            taker = await register(client, "taker")
+            await deposit(client, admin, maker, "FOO", 10)
+            await deposit(client, admin, taker, "MEMCOIN", 40)
+            for price in (10, 11):
+                await place(client, maker, type="LIMIT", direction="SELL", ticker="FOO", qty=3, price=price)
+
+            # 3 @ 10 is affordable, the second level is not
+            response = await place(client, taker, type="MARKET", direction="BUY", ticker="FOO", qty=5)
+            book = (await client.get("/api/v1/public/orderbook/FOO")).json()
+            resting = sorted((order["filled"], order["remaining"]) for order in main.books["FOO"].orders.values())
+            return response, book, resting, await balance(client, maker), await balance(client, taker)
+
+    response, book, resting, maker_balance, taker_balance = asyncio.run(scenario())
+    assert response.status_code == 400
+    assert response.json() == {"detail": "Insufficient funds"}
+    assert book == {"bid_levels": [], "ask_levels": [{"price": 10, "qty": 3}, {"price": 11, "qty": 3}]}
+    assert maker_balance == {"FOO": 10}
+    assert taker_balance == {"MEMCOIN": 40}
+    assert query("SELECT COUNT(*) FROM transactions") == [(0,)]
+    assert query("SELECT status, filled, remaining FROM orders ORDER BY price") == [
+        ("NEW", 0, 3),
+        ("NEW", 0, 3),
+    ]
+    assert resting == [(0, 3), (0, 3)]
@@ -0,0 +1,132 @@
+import random
+from uuid import uuid4
+
+from main import Book
+
+
+def make_order(direction: str, price: int, qty: int, user_id: bytes = b"u") -> dict:
+    return {
+        "id": uuid4().bytes,
+        "user_id": user_id,
+        "direction": direction,
+        "price": price,
+        "qty": qty,
+        "filled": 0,
+        "remaining": qty,
+    }
+
+
+def assert_consistent(book: Book):
+    # totals must equal the remaining quantity resting on every level
+    for direction in ("BUY", "SELL"):
+        side = book.side(direction)
+        assert set(side) == set(book.totals[direction])
+        for price, level in side.items():
+            assert level
+            assert book.totals[direction][price] == sum(order["remaining"] for order in level)
+    assert len(book.orders) == sum(len(level) for level in book.bids.values()) + sum(
+        len(level) for level in book.asks.values()
+    )
+
+
+def test_levels_are_best_price_first_with_totals():
+    book = Book()
+    for price, qty in ((10, 2), (12, 5), (10, 3), (11, 1)):
+        book.add(make_order("SELL", price, qty))
+    for price, qty in ((5, 4), (7, 1), (5, 1)):
+        book.add(make_order("BUY", price, qty))
+
+    assert book.levels("SELL", 10) == [
+        {"price": 10, "qty": 5},
+        {"price": 11, "qty": 1},
+        {"price": 12, "qty": 5},
+    ]
+    assert book.levels("BUY", 10) == [{"price": 7, "qty": 1}, {"price": 5, "qty": 5}]
+    assert book.levels("SELL", 2) == [{"price": 10, "qty": 5}, {"price": 11, "qty": 1}]
+    assert_consistent(book)
+
+
+def test_remove_updates_totals_and_drops_empty_levels():
+    book = Book()
+    first = make_order("SELL", 10, 2)
+    second = make_order("SELL", 10, 3)
+    book.add(first)
+    book.add(second)
+
+    book.remove(first["id"])
+    assert book.levels("SELL", 10) == [{"price": 10, "qty": 3}]
+    book.remove(second["id"])
+    assert book.levels("SELL", 10) == []
+    book.remove(second["id"])
+    assert_consistent(book)
+
+
+def test_match_fills_best_price_then_fifo():
+    book = Book()
+    late = make_order("SELL", 10, 4)
+    cheap = make_order("SELL", 9, 1)
+    early = make_order("SELL", 10, 2)
+    book.add(early)
+    book.add(late)
+    book.add(cheap)
+
+    fills = book.match("BUY", 5)
+
+    assert [(order["id"], qty) for order, qty in fills] == [
+        (cheap["id"], 1),
+        (early["id"], 2),
+        (late["id"], 2),
+    ]
+    # Planning a match leaves the book untouched
+    assert book.levels("SELL", 10) == [{"price": 9, "qty": 1}, {"price": 10, "qty": 6}]
+
+
+def test_fill_removes_completed_orders_only():
+    book = Book()
+    first = make_order("BUY", 10, 2)
+    second = make_order("BUY", 10, 3)
+    book.add(first)
+    book.add(second)
+
+    for order, qty in book.match("SELL", 4):
+        book.fill(order, qty)
+
+    assert first["id"] not in book.orders
+    assert second["filled"] == 2 and second["remaining"] == 1
+    assert book.levels("BUY", 10) == [{"price": 10, "qty": 1}]
+    assert_consistent(book)
+
+
+def test_remove_user_keeps_other_orders():
+    book = Book()
+    book.add(make_order("SELL", 10, 2, user_id=b"a"))
+    book.add(make_order("SELL", 10, 3, user_id=b"b"))
+    book.add(make_order("BUY", 8, 1, user_id=b"a"))
+
+    book.remove_user(b"a")
+
+    assert book.levels("SELL", 10) == [{"price": 10, "qty": 3}]
+    assert book.levels("BUY", 10) == []
+    assert_consistent(book)
+
+
+def test_random_operations_keep_totals_consistent():
+    rng = random.Random(1234)
+    book = Book()
+    for _ in range(3000):
+        action = rng.random()
+        direction = rng.choice(("BUY", "SELL"))
+        if action < 0.5 or not book.orders:
+            book.add(make_order(direction, rng.randint(1, 20), rng.randint(1, 10)))
+        elif action < 0.75:
+            book.remove(rng.choice(list(book.orders)))
+        else:
+            qty = rng.randint(1, 30)
+            opposite = "SELL" if direction == "BUY" else "BUY"
+            available = sum(book.totals[opposite].values())
+            fills = book.match(direction, qty)
+            assert sum(fill_qty for _, fill_qty in fills) == min(qty, available)
+            for order, fill_qty in fills:
+                assert 0 < fill_qty <= order["remaining"]
+                book.fill(order, fill_qty)
+        assert_consistent(book)
@@ -0,0 +1,213 @@
+import asyncio
+from uuid import UUID
+
+import main
+from conftest import (
+    balance,
+    deposit,
+    list_instrument,
+    place,
+    query,
+    register,
+    register_admin,
+    running_app,
+)
+
+
+def test_concurrent_market_orders_are_serialized():
+    async def scenario():
+        async with running_app() as client:
+            admin = await register_admin(client)
+            await list_instrument(client, admin)
+            maker = await register(client, "maker")
+            await deposit(client, admin, maker, "FOO", 100)
+            for price in (12, 10, 11):
+                response = await place(client, maker, type="LIMIT", direction="SELL", ticker="FOO", qty=20, price=price)
+                assert response.status_code == 200
+
+            takers = [await register(client, f"taker{i}") for i in range(10)]
+            for taker in takers:
+                await deposit(client, admin, taker, "MEMCOIN", 1000)
+
+            responses = await asyncio.gather(*[
+                place(client, taker, type="MARKET", direction="BUY", ticker="FOO", qty=5)
+                for taker in takers
+            ])
+            assert [response.status_code for response in responses] == [200] * 10
+
+            book = (await client.get("/api/v1/public/orderbook/FOO")).json()
+            taker_balances = [await balance(client, taker) for taker in takers]
+            return book, await balance(client, maker), taker_balances
+
+    book, maker_balance, taker_balances = asyncio.run(scenario())
+
+    # 50 of the 60 resting units trade exactly once, cheapest level first
+    assert book == {"bid_levels": [], "ask_levels": [{"price": 12, "qty": 10}]}
+    assert maker_balance == {"FOO": 50, "MEMCOIN": 20 * 10 + 20 * 11 + 10 * 12}
+    assert all(taker["FOO"] == 5 for taker in taker_balances)
+    assert sum(1000 - taker["MEMCOIN"] for taker in taker_balances) == maker_balance["MEMCOIN"]
+    assert query("SELECT SUM(amount) FROM transactions") == [(50,)]
+    assert query("SELECT SUM(filled) FROM orders WHERE price IS NOT NULL") == [(50,)]
+    assert query("SELECT COUNT(*) FROM orders WHERE remaining != qty - filled") == [(0,)]
+
+
+def test_open_orders_are_reloaded_on_startup():
+    async def place_orders():
+        async with running_app() as client:
+            admin = await register_admin(client)
+            await list_instrument(client, admin)
+            await deposit(client, admin, admin, "MEMCOIN", 1000)
+            await deposit(client, admin, admin, "FOO", 10)
+            await place(client, admin, type="LIMIT", direction="SELL", ticker="FOO", qty=5, price=10)
+            await place(client, admin, type="LIMIT", direction="BUY", ticker="FOO", qty=3, price=8)
+            await place(client, admin, type="MARKET", direction="BUY", ticker="FOO", qty=2)
+
+    async def read_book():
+        async with running_app() as client:
+            return (await client.get("/api/v1/public/orderbook/FOO")).json()
+
+    asyncio.run(place_orders())
+    main.books.clear()
+
+    assert asyncio.run(read_book()) == {
+        "bid_levels": [{"price": 8, "qty": 3}],
+        "ask_levels": [{"price": 10, "qty": 3}],
+    }
+
+
+def test_many_concurrent_orders_do_not_exhaust_the_pool():
+    async def scenario():
+        async with running_app() as client:
+            admin = await register_admin(client)
+            await list_instrument(client, admin)
+            responses = await asyncio.wait_for(asyncio.gather(*[
+                place(client, admin, type="LIMIT", direction="BUY", ticker="FOO", qty=1, price=5)
+                for _ in range(60)
+            ]), timeout=10)
+            return [response.status_code for response in responses]
+
+    assert asyncio.run(scenario()) == [200] * 60
+
+
+def test_stopping_a_matcher_resolves_pending_operations():
+    async def scenario():
+        async with running_app() as client:
+            admin = await register_admin(client)
+            await list_instrument(client, admin)
+
+            async def slow_operation(book):
+                await asyncio.sleep(0.05)
+                return "done"
+
+            running = asyncio.ensure_future(main.submit("FOO", slow_operation))
+            queued = asyncio.ensure_future(main.submit("FOO", slow_operation))
+            await asyncio.sleep(0.01)
+            worker = main.stop_matcher("FOO")
+
+            results = await asyncio.wait_for(
+                asyncio.gather(running, queued, return_exceptions=True), timeout=2
+            )
+            await asyncio.wait_for(worker, timeout=1)
+            return results
+
+    running, queued = asyncio.run(scenario())
+    assert running == "done"
+    assert queued.status_code == 404
+
+
+def test_deleted_user_orders_never_match():
+    async def scenario():
+        async with running_app() as client:
+            admin = await register_admin(client)
+            await list_instrument(client, admin)
+            taker = await register(client, "taker")
+            await deposit(client, admin, taker, "MEMCOIN", 10_000)
+
+            statuses = []
+            racing = []
+            for _ in range(10):
+                maker = await register(client, "maker")
+                await deposit(client, admin, maker, "FOO", 10)
+                for _ in range(5):
+                    await place(client, maker, type="LIMIT", direction="SELL", ticker="FOO", qty=2, price=10)
+                
+                # The user's own orders race their deletion; each must be
+                # placed, refused as an unknown user or fail authentication
+                async def place_later(delay: float):
+                    await asyncio.sleep(delay)
+                    return await place(client, maker, type="LIMIT", direction="SELL", ticker="FOO", qty=1, price=10)
+                
+                responses = await asyncio.gather(
+                    place(client, taker, type="MARKET", direction="BUY", ticker="FOO", qty=3),
+                    client.delete(f"/api/v1/admin/user/{maker['id']}", headers=admin["headers"]),
+                    place(client, taker, type="MARKET", direction="BUY", ticker="FOO", qty=3),
+                    *[place_later(delay / 1000) for delay in range(5)],
+                )
+                statuses.extend(response.status_code for response in responses[:3])
+                racing.extend(response.status_code for response in responses[3:])
+                assert not main.books["FOO"].orders
+                assert query("SELECT COUNT(*) FROM users WHERE id = ?", UUID(maker["id"]).bytes) == [(0,)]
+                assert query("SELECT COUNT(*) FROM orders WHERE user_id = ?", UUID(maker["id"]).bytes) == [(0,)]
+            return statuses, racing
+
+    statuses, racing = asyncio.run(scenario())
+    assert statuses == [200] * 30
+    assert set(racing) <= {200, 401, 404}
+
+
+def test_deleting_an_instrument_waits_for_its_matcher(monkeypatch):
+    add_limit_order = main.add_limit_order
+
+    async def slow_add_limit_order(book, order):
+        await asyncio.sleep(0.01)
+        await add_limit_order(book, order)
+
+    monkeypatch.setattr(main, "add_limit_order", slow_add_limit_order)
+
+    async def scenario():
+        async with running_app() as client:
+            admin = await register_admin(client)
+            await list_instrument(client, admin)
+            await deposit(client, admin, admin, "FOO", 100)
+
+            responses = await asyncio.gather(
+                *[place(client, admin, type="LIMIT", direction="SELL", ticker="FOO", qty=1, price=10) for _ in range(5)],
+                client.delete("/api/v1/admin/instrument/FOO", headers=admin["headers"]),
+                *[place(client, admin, type="LIMIT", direction="SELL", ticker="FOO", qty=1, price=10) for _ in range(5)],
+            )
+            # Orders queued ahead of the delete complete, later ones are refused
+            assert [response.status_code for response in responses] == [200] * 6 + [404] * 5
+            assert all(response.json()["detail"] == "Instrument not found" for response in responses[6:])
+            assert query("SELECT COUNT(*) FROM orders WHERE ticker = 'FOO'") == [(0,)]
+
+            # A re-listed instrument starts from an empty book
+            await list_instrument(client, admin)
+            response = await place(client, admin, type="LIMIT", direction="SELL", ticker="FOO", qty=2, price=11)
+            assert response.status_code == 200
+            return (await client.get("/api/v1/public/orderbook/FOO")).json()
+
+    assert asyncio.run(scenario()) == {"bid_levels": [], "ask_levels": [{"price": 11, "qty": 2}]}
+
+
+def test_invalid_order_bodies_are_rejected_like_fastapi():
+    async def scenario():
+        async with running_app() as client:
+            admin = await register_admin(client)
+            await list_instrument(client, admin)
+            bodies = [
+                {"direction": "BUY", "ticker": "FOO", "qty": 1, "price": 10},
+                {"type": "LIMIT", "direction": "BUY", "ticker": "FOO", "qty": 1},
+                {"type": "MARKET", "direction": "BUY", "ticker": "FOO", "qty": 0},
+            ]
+            responses = [await place(client, admin, **body) for body in bodies]
+            responses.append(await client.post("/api/v1/order", headers=admin["headers"], content=b'{"type": '))
+            assert [response.status_code for response in responses] == [422] * 4
+            assert not main.books["FOO"].orders
+            return [response.json()["detail"] for response in responses]
+
+    missing_type, missing_price, zero_qty, malformed = asyncio.run(scenario())
+
+    assert missing_type == [{"type": "missing", "loc": ["body", "type"], "msg": "Field required"}]
+    assert missing_price == [{"type": "missing", "loc": ["body", "price"], "msg": "Field required"}]
+    assert zero_qty == [{"type": "value_error", "loc": ["body", "qty"], "msg": "Expected `int` >= 1"}]
+    assert malformed == [{"type": "json_invalid", "loc": ["body"], "msg": "Input data was truncated"}]